@@ -0,0 +1,33 @@
+// ============================================================================
+// tb_aux.sv — Testbench-only observability counters for the cocotb suite
+// ============================================================================
+// Bound into brv32p_soc so the Python tests read one packed count over
+// VPI instead of scanning the 128 I-cache valid bits and 256 BHT
+// entries element by element. Not part of the synthesizable design.
+// ============================================================================
+
+module brv32p_tb_aux;
+
+  // Number of valid I-cache lines (64 sets x 2 ways).
+  logic [7:0] icache_valid_count;
+
+  // Number of BHT entries that have left the 2'b01 reset state.
+  logic [8:0] bht_trained_count;
+
+  always_comb begin
+    icache_valid_count = '0;
+    for (int s = 0; s < 64; s++)
+      for (int w = 0; w < 2; w++)
+        icache_valid_count += 8'(u_icache.valid_mem[s][w]);
+  end
+
+  always_comb begin
+    bht_trained_count = '0;
+    for (int i = 0; i < 256; i++)
+      if (u_core.u_bp.bht[i] != 2'b01)
+        bht_trained_count += 9'd1;
+  end
+
+endmodule
+
+bind brv32p_soc brv32p_tb_aux u_aux ();
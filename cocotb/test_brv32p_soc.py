@@ -5,49 +5,284 @@ Tests pipeline execution, forwarding, cache behaviour, branch prediction,
 and all functional instruction categories.
 """
 
+import os
+import sys
+
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, ClockCycles
+from cocotb.triggers import RisingEdge, ClockCycles, Edge, First, Timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "firmware"))
+from gen_firmware import program  # noqa: E402
+
+# Verilator flattens unpacked arrays differently from the event-driven
+# simulators; dispatch on SIM instead of probing with exceptions.
+_SIM = os.environ.get("SIM", "icarus")
+
+
+# Regfile handles, resolved once after the hierarchy is known to exist.
+# The handles either resolve or the bench is unusable, so the accessors
+# below carry no per-call try/except.
+_regs = None
+
+# cocotb runs all tests back to back in one simulator invocation, so the
+# clock coroutine only needs to be started once, not once per test.
+_clock_started = False
+
+
+def start_clock(dut):
+    """Start the free-running 10 ns clock; later calls are no-ops."""
+    global _clock_started
+    if not _clock_started:
+        cocotb.start_soon(Clock(dut.clk, 10, units="ns").start())
+        _clock_started = True
+
+
+_reset_done = False
 
 
 async def reset_dut(dut, cycles=10):
+    global _regs, _reset_done
+    start_clock(dut)
+    _reset_done = True
+    if _regs is None:
+        _regs = [None] + [dut.u_core.u_regfile.regs[i] for i in range(1, 32)]
     dut.rst_n.value = 0
     dut.gpio_in.value = 0
     dut.uart_rx.value = 1
+    # Python already sits beside the simulator, so deposit the firmware
+    # straight into the SRAM while reset is held — no firmware.hex
+    # round-trip. $readmemh stays as the path for the standalone SV
+    # testbench. Reloading on every reset also restores any code words
+    # a previous run overwrote.
+    for i, word in enumerate(program):
+        dut.u_sram.mem[i].value = word
     await ClockCycles(dut.clk, cycles)
     dut.rst_n.value = 1
     await RisingEdge(dut.clk)
 
 
+def _reg_handle(dut, idx):
+    """Handle for regs[idx], from the cache once reset_dut has run."""
+    if _regs is not None:
+        return _regs[idx]
+    return dut.u_core.u_regfile.regs[idx]
+
+
+async def ensure_running(dut):
+    """Bring the DUT out of reset once; a no-op when it already is.
+
+    Tests that only need a live, running DUT use this instead of paying
+    the 10-cycle reset (and the firmware restart behind it) again.
+    Checkpoint/restore of simulator state would buy nothing on top:
+    the expensive part — the firmware run — is already shared via
+    run_firmware_once.
+    """
+    if _reset_done:
+        start_clock(dut)
+    else:
+        await reset_dut(dut)
+
+
 def get_reg(dut, idx):
     if idx == 0:
         return 0
-    return int(dut.u_core.u_regfile.regs[idx].value)
+    return int(_reg_handle(dut, idx).value)
+
+
+# Whether the simulator accepts a value-change callback on a regfile
+# word, probed on wait_reg's first use. Some VPI implementations refuse
+# Edge on unpacked-array elements; interval polling takes over then.
+_edge_ok = None
 
 
 async def wait_reg(dut, idx, val, timeout=50000):
-    """Wait until register idx == val, with timeout."""
-    for _ in range(timeout):
-        await RisingEdge(dut.clk)
+    """Wait until register idx == val, with timeout in clock cycles.
+
+    Python only wakes when regs[idx] actually changes (Edge trigger on
+    the entry) or when the timeout budget of simulated time elapses,
+    whichever wins the race — the simulator runs unsupervised in
+    between. If the simulator refuses an Edge on a regfile word, falls
+    back to sampling every 8 cycles; every value this suite waits on is
+    stable once reached, so coarse sampling cannot miss it.
+    """
+    global _edge_ok
+    if idx == 0:
+        return val == 0
+    h = _reg_handle(dut, idx)
+    # The register may already hold val, in which case no edge will come.
+    if int(h.value) == val:
+        return True
+
+    if _edge_ok is None:
         try:
-            if get_reg(dut, idx) == val:
-                return True
+            await First(Edge(h), RisingEdge(dut.clk))
+            _edge_ok = True
         except Exception:
-            pass
-    dut._log.warning(f"Timeout waiting for x{idx} = 0x{val:08X}")
-    return False
+            _edge_ok = False
+        if int(h.value) == val:
+            return True
+
+    if not _edge_ok:
+        for _ in range(max(1, timeout // 8)):
+            await ClockCycles(dut.clk, 8)
+            if int(h.value) == val:
+                return True
+        dut._log.warning(f"Timeout waiting for x{idx} = 0x{val:08X}")
+        return False
 
+    async def poll():
+        while int(h.value) != val:
+            await Edge(h)
 
-async def wait_reg_nonzero(dut, idx, timeout=50000):
+    task = cocotb.start_soon(poll())
+    done = task.join()
+    deadline = Timer(timeout * 10, units="ns")  # 10 ns per clock cycle
+    winner = await First(done, deadline)
+    if winner is deadline:
+        task.kill()
+        dut._log.warning(f"Timeout waiting for x{idx} = 0x{val:08X}")
+        return False
+    return True
+
+
+async def wait_reg_nonzero(dut, idx, timeout=50000, poll_interval=8):
     """Wait until register idx != 0."""
-    for _ in range(timeout):
-        await RisingEdge(dut.clk)
+    if idx == 0:
+        return False
+    h = _reg_handle(dut, idx)
+    for _ in range(max(1, timeout // poll_interval)):
+        await ClockCycles(dut.clk, poll_interval)
+        if int(h.value) != 0:
+            return True
+    return False
+
+
+_csr_handles = {}
+
+
+def read_counters(dut):
+    """Read (mcycle, minstret) via cached handles to the 32-bit aliases.
+
+    The aliases in csr.sv carry only the low counter words, so no
+    & 0xFFFFFFFF truncation is needed here.
+    """
+    if not _csr_handles:
+        u_csr = dut.u_core.u_csr
+        _csr_handles["mcycle"] = u_csr.mcycle_lo
+        _csr_handles["minstret"] = u_csr.minstret_lo
+    return (int(_csr_handles["mcycle"].value),
+            int(_csr_handles["minstret"].value))
+
+
+def scan_bht_trained(dut):
+    """Count BHT entries that have left the 2'b01 reset state.
+
+    Tries one bulk read of the whole array — a single VPI crossing on
+    simulators that expose unpacked arrays as one packed value — and
+    falls back to 256 per-element reads. The count is independent of
+    element ordering within the packed value, so no endianness probe is
+    needed.
+    """
+    # The bound tb_aux counters compute the count RTL-side; one narrow
+    # read replaces the whole scan when the simulator supports bind.
+    try:
+        return int(dut.u_aux.bht_trained_count.value)
+    except AttributeError:
+        pass
+    bht = dut.u_core.u_bp.bht
+    if _SIM != "verilator":
         try:
-            if get_reg(dut, idx) != 0:
-                return True
-        except Exception:
+            bv = int(bht.value)
+            return sum(1 for i in range(256) if ((bv >> (2 * i)) & 3) != 1)
+        except (TypeError, ValueError):
             pass
-    return False
+    # Element fallback: probe the array once, then scan with a
+    # comprehension — no per-iteration exception frame.
+    try:
+        bht[0]
+    except (IndexError, AttributeError, TypeError):
+        return 0
+    vals = [int(bht[i].value) for i in range(256)]
+    return sum(1 for v in vals if v != 1)
+
+
+def scan_icache_valid(dut):
+    """Count valid I-cache lines via one bulk read, with per-way fallback."""
+    try:
+        return int(dut.u_aux.icache_valid_count.value)
+    except AttributeError:
+        pass
+    valid_mem = dut.u_icache.valid_mem
+    if _SIM != "verilator":
+        try:
+            return bin(int(valid_mem.value)).count("1")
+        except (TypeError, ValueError):
+            pass
+    try:
+        valid_mem[0][0]
+    except (IndexError, AttributeError, TypeError):
+        return 0
+    return sum(int(valid_mem[s][w].value)
+               for s in range(64) for w in range(2))
+
+
+# ── Shared firmware run ──────────────────────────────────────────────────
+# The firmware is deterministic and every functional test observes the
+# same execution, so it is run exactly once. A background monitor records
+# each regfile write into a trace; tests assert against the recorded
+# values instead of re-resetting and replaying the program.
+
+_fw_trace = None   # list of (cycle, reg, value) in write order
+_fw_final = None   # reg -> last value written
+
+
+async def monitor_regfile(dut, trace):
+    """Record every regfile write as (cycle, reg, value)."""
+    wr_en = dut.u_core.u_regfile.wr_en
+    rd_addr = dut.u_core.u_regfile.rd_addr
+    rd_data = dut.u_core.u_regfile.rd_data
+    cycle = 0
+    while True:
+        await RisingEdge(dut.clk)
+        cycle += 1
+        if wr_en.value and int(rd_addr.value) != 0:
+            trace.append((cycle, int(rd_addr.value), int(rd_data.value)))
+
+
+async def run_firmware_once(dut):
+    """Reset, run the firmware to completion once, return reg -> final value.
+
+    The first caller pays for the run; subsequent callers get the cached
+    trace without touching the simulator.
+    """
+    global _fw_trace, _fw_final
+    if _fw_final is not None:
+        return _fw_final
+
+    await reset_dut(dut)
+
+    trace = []
+    mon = cocotb.start_soon(monitor_regfile(dut, trace))
+
+    # x23 is zero out of reset as well, so first wait for the countdown
+    # value to load, then for the loop to count it back down.
+    ok = await wait_reg_nonzero(dut, 23)
+    assert ok, "Firmware never reached the countdown loop"
+    ok = await wait_reg(dut, 23, 0, timeout=100000)
+    assert ok, "Firmware countdown loop did not complete"
+    # Let the tail of the program (AUIPC, CSR read, ECALL) retire. Keep
+    # this short: ECALL traps to mtvec=0 and restarts the program, and
+    # the monitor must stop before the next round reloads x23.
+    await ClockCycles(dut.clk, 10)
+    mon.kill()
+
+    _fw_trace = trace
+    _fw_final = {}
+    for _, reg, val in trace:
+        _fw_final[reg] = val
+    return _fw_final
 
 
 # ── Tests ────────────────────────────────────────────────────────────────
@@ -55,8 +290,7 @@ async def wait_reg_nonzero(dut, idx, timeout=50000):
 @cocotb.test()
 async def test_01_reset(dut):
     """Verify PC starts at reset vector."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
+    start_clock(dut)
     dut.rst_n.value = 0
     dut.gpio_in.value = 0
     dut.uart_rx.value = 1
@@ -69,13 +303,7 @@ async def test_01_reset(dut):
 @cocotb.test()
 async def test_02_alu_pipeline(dut):
     """Test ALU instructions execute correctly through pipeline with forwarding."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
-
-    # Wait for first results to appear in register file
-    ok = await wait_reg(dut, 3, 52)
-    assert ok, "x3 never reached 52"
+    final = await run_firmware_once(dut)
 
     checks = [
         (1, 42, "ADDI"), (2, 10, "ADDI"), (3, 52, "ADD"),
@@ -83,7 +311,7 @@ async def test_02_alu_pipeline(dut):
         (7, 0xAA, "XORI"), (8, 160, "SLLI"), (9, 40, "SRLI"),
     ]
     for reg, exp, name in checks:
-        val = get_reg(dut, reg)
+        val = final.get(reg)
         assert val == exp, f"{name} x{reg}: got {val}, expected {exp}"
         dut._log.info(f"PASS: {name} x{reg} = {val}")
 
@@ -91,76 +319,55 @@ async def test_02_alu_pipeline(dut):
 @cocotb.test()
 async def test_03_forwarding(dut):
     """Verify data forwarding: ADD x3=x1+x2 uses freshly-written x1, x2."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    final = await run_firmware_once(dut)
 
-    ok = await wait_reg(dut, 3, 52)
-    assert ok, "Forwarding failed: x3 != 52"
+    assert final.get(3) == 52, "Forwarding failed: x3 != 52"
     dut._log.info("PASS: EX-EX forwarding verified (x3=x1+x2=52)")
 
 
 @cocotb.test()
 async def test_04_load_store_cache(dut):
     """Test load/store through the D-cache."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    final = await run_firmware_once(dut)
 
-    ok = await wait_reg(dut, 11, 52)
-    assert ok, "LW through D-cache failed"
-    dut._log.info(f"PASS: LW x11 = {get_reg(dut, 11)}")
+    assert final.get(11) == 52, "LW through D-cache failed"
+    dut._log.info(f"PASS: LW x11 = {final[11]}")
 
-    ok = await wait_reg(dut, 12, 0x55)
-    assert ok, "LBU through D-cache failed"
-    dut._log.info(f"PASS: LBU x12 = 0x{get_reg(dut, 12):02X}")
+    assert final.get(12) == 0x55, "LBU through D-cache failed"
+    dut._log.info(f"PASS: LBU x12 = 0x{final[12]:02X}")
 
 
 @cocotb.test()
 async def test_05_branches(dut):
     """Test BEQ/BNE through pipeline with prediction."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    final = await run_firmware_once(dut)
 
-    ok = await wait_reg(dut, 15, 2)
-    assert ok, "Branch test failed"
-    dut._log.info(f"PASS: Branches — x15 = {get_reg(dut, 15)}")
+    assert final.get(15) == 2, "Branch test failed"
+    assert 0xDE not in [v for _, r, v in _fw_trace if r == 15], \
+        "Dead code after a taken branch wrote x15"
+    dut._log.info(f"PASS: Branches — x15 = {final[15]}")
 
 
 @cocotb.test()
 async def test_06_jal(dut):
     """Test JAL saves link and reaches target."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    final = await run_firmware_once(dut)
 
-    ok = await wait_reg(dut, 17, 3)
-    assert ok, "JAL target not reached"
-    assert get_reg(dut, 16) != 0, "JAL link register is zero"
-    dut._log.info(f"PASS: JAL — x17={get_reg(dut, 17)}, x16=0x{get_reg(dut, 16):08X}")
+    assert final.get(17) == 3, "JAL target not reached"
+    assert final.get(16, 0) != 0, "JAL link register is zero"
+    dut._log.info(f"PASS: JAL — x17={final[17]}, x16=0x{final[16]:08X}")
 
 
 @cocotb.test()
 async def test_07_loop_bp_training(dut):
     """Test BNE countdown loop trains the branch predictor."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    final = await run_firmware_once(dut)
 
-    ok = await wait_reg(dut, 23, 0, timeout=100000)
-    assert ok, "Loop did not complete"
+    assert final.get(23) == 0, "Loop did not complete"
     dut._log.info("PASS: Countdown loop x23 = 0")
 
-    # Check BHT was trained
-    trained = 0
-    for i in range(256):
-        try:
-            val = int(dut.u_core.u_bp.bht[i].value)
-            if val != 1:  # Default is 2'b01
-                trained += 1
-        except Exception:
-            pass
+    # Check BHT was trained (default entry is 2'b01)
+    trained = scan_bht_trained(dut)
     assert trained > 0, "No BHT entries trained"
     dut._log.info(f"PASS: BHT has {trained} trained entries")
 
@@ -168,21 +375,9 @@ async def test_07_loop_bp_training(dut):
 @cocotb.test()
 async def test_08_icache(dut):
     """Verify I-cache fills lines during execution."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
-
-    await wait_reg(dut, 3, 52)  # Wait for some execution
-
-    valid_count = 0
-    for s in range(64):
-        for w in range(2):
-            try:
-                if int(dut.u_icache.valid_mem[s][w].value):
-                    valid_count += 1
-            except Exception:
-                pass
+    await run_firmware_once(dut)
 
+    valid_count = scan_icache_valid(dut)
     assert valid_count > 0, "I-cache has no valid lines"
     dut._log.info(f"PASS: I-cache has {valid_count} valid lines")
 
@@ -190,9 +385,7 @@ async def test_08_icache(dut):
 @cocotb.test()
 async def test_09_gpio_input(dut):
     """Test GPIO input synchronisation."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    await ensure_running(dut)
     await ClockCycles(dut.clk, 20)
 
     dut.gpio_in.value = 0xCAFEBABE
@@ -206,43 +399,33 @@ async def test_09_gpio_input(dut):
 @cocotb.test()
 async def test_10_csr_mcycle(dut):
     """Test mcycle counter increments."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
-    await ClockCycles(dut.clk, 100)
+    await ensure_running(dut)
 
-    mcycle = int(dut.u_core.u_csr.mcycle.value) & 0xFFFFFFFF
-    assert mcycle > 0, f"mcycle = {mcycle}"
+    before, _ = read_counters(dut)
+    await ClockCycles(dut.clk, 100)
+    mcycle, _ = read_counters(dut)
+    assert mcycle > before, f"mcycle = {mcycle}, was {before}"
     dut._log.info(f"PASS: mcycle = {mcycle}")
 
 
 @cocotb.test()
 async def test_11_load_use_stall(dut):
     """Verify pipeline doesn't corrupt data on load-use sequences."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
+    final = await run_firmware_once(dut)
 
     # The firmware has: SW x3, 0(x10) then LW x11, 0(x10)
     # This is a load followed by use — the hazard unit should insert
     # a 1-cycle bubble. If it doesn't, x11 would get stale data.
-    ok = await wait_reg(dut, 11, 52)
-    assert ok, "Load-use stall may have failed: x11 != 52"
+    assert final.get(11) == 52, "Load-use stall may have failed: x11 != 52"
     dut._log.info("PASS: Load-use stall correctly handled")
 
 
 @cocotb.test()
 async def test_12_pipeline_throughput(dut):
     """Measure approximate IPC by counting retired instructions vs cycles."""
-    clock = Clock(dut.clk, 10, units="ns")
-    cocotb.start_soon(clock.start())
-    await reset_dut(dut)
-
-    # Wait for program to mostly complete
-    ok = await wait_reg(dut, 23, 0, timeout=100000)
+    await run_firmware_once(dut)
 
-    mcycle = int(dut.u_core.u_csr.mcycle.value) & 0xFFFFFFFF
-    minstret = int(dut.u_core.u_csr.minstret.value) & 0xFFFFFFFF
+    mcycle, minstret = read_counters(dut)
 
     if mcycle > 0 and minstret > 0:
         ipc = minstret / mcycle
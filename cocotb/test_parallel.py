@@ -0,0 +1,94 @@
+"""
+test_parallel.py — run the BRV32P regression as parallel pytest shards
+======================================================================
+Wraps the cocotb suite with cocotb-test so pytest-xdist can spread four
+independent simulator invocations across cores:
+
+    pip install pytest pytest-xdist cocotb-test
+    cd cocotb
+    pytest test_parallel.py -n 4
+
+Each shard is a fresh simulator process running a subset of
+test_brv32p_soc, so the shards are grouped to be self-contained: the
+first test in a shard that needs the firmware triggers its own
+run_firmware_once. Every shard keeps its own sim_build directory —
+sharing one Verilator build across concurrently starting workers is a
+write race, and the per-shard build is cached after the first run.
+
+The plain `make` flow is unchanged and remains the single-process way
+to run everything.
+"""
+
+import os
+
+import pytest
+
+simulator = pytest.importorskip("cocotb_test.simulator")
+
+# cocotb-test falls back to Icarus when SIM is unset; default to
+# Verilator like the Makefile does. Setting it in the environment also
+# steers cocotb-test itself and the scan-helper dispatch in
+# test_brv32p_soc.
+_SIM = os.environ.setdefault("SIM", "verilator")
+
+_RTL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rtl")
+
+VERILOG_SOURCES = [os.path.join(_RTL, p) for p in [
+    "pkg/brv32p_pkg.sv",
+    "core/alu.sv",
+    "core/regfile.sv",
+    "core/compressed_decoder.sv",
+    "core/decoder.sv",
+    "core/branch_predictor.sv",
+    "core/hazard_unit.sv",
+    "core/muldiv.sv",
+    "core/csr.sv",
+    "core/brv32p_core.sv",
+    "cache/icache.sv",
+    "cache/dcache.sv",
+    "bus/axi_interconnect.sv",
+    "bus/axi_sram.sv",
+    "bus/axi_periph_bridge.sv",
+    "periph/gpio.sv",
+    "periph/uart.sv",
+    "periph/timer.sv",
+    "brv32p_soc.sv",
+]]
+
+# tb_aux.sv uses 'bind' and only compiles under Verilator; other
+# simulators rely on the scan-helper fallbacks instead.
+if _SIM == "verilator":
+    VERILOG_SOURCES.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "tb_aux.sv"))
+
+TEST_GROUPS = {
+    "alu": ["test_01_reset", "test_02_alu_pipeline", "test_03_forwarding"],
+    "memory": ["test_04_load_store_cache", "test_08_icache",
+               "test_11_load_use_stall"],
+    "branch": ["test_05_branches", "test_06_jal",
+               "test_07_loop_bp_training"],
+    "io": ["test_09_gpio_input", "test_10_csr_mcycle",
+           "test_12_pipeline_throughput"],
+}
+
+
+@pytest.mark.parametrize("group", sorted(TEST_GROUPS))
+def test_group(group):
+    names = TEST_GROUPS[group]
+    simulator.run(
+        verilog_sources=VERILOG_SOURCES,
+        toplevel="brv32p_soc",
+        module="test_brv32p_soc",
+        # Select the subset through the environment rather than the
+        # testcase= kwarg: cocotb-test copies that kwarg into the
+        # subprocess env verbatim (a list is a TypeError), and cocotb
+        # 2.x ignores the TESTCASE variable it would set anyway.
+        # COCOTB_TEST_FILTER is a regex searched against the full test
+        # name (cocotb 2.x); TESTCASE covers cocotb 1.x, which ignores
+        # the other variable.
+        extra_env={
+            "COCOTB_TEST_FILTER": "(" + "|".join(names) + ")$",
+            "TESTCASE": ",".join(names),
+        },
+        sim_build=f"sim_build_{group}",
+    )
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 """Generate a test firmware hex file for BRV32 MCU with correct RV32I encodings."""
+import array
+import binascii
+import os
+import sys
 
 def r_type(funct7, rs2, rs1, funct3, rd, opcode=0x33):
     return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
@@ -35,27 +39,32 @@ x0, x1, x2, x3, x4, x5, x6, x7 = 0, 1, 2, 3, 4, 5, 6, 7
 x8, x9, x10, x11, x12, x13, x14, x15 = 8, 9, 10, 11, 12, 13, 14, 15
 x16, x17, x18, x19, x20, x21, x22, x23 = 16, 17, 18, 19, 20, 21, 22, 23
 
-def addi(rd, rs1, imm):  return i_type(imm, rs1, 0, rd, 0x13)
-def add(rd, rs1, rs2):   return r_type(0x00, rs2, rs1, 0, rd, 0x33)
-def sub(rd, rs1, rs2):   return r_type(0x20, rs2, rs1, 0, rd, 0x33)
-def andi(rd, rs1, imm):  return i_type(imm, rs1, 7, rd, 0x13)
-def ori(rd, rs1, imm):   return i_type(imm, rs1, 6, rd, 0x13)
-def xori(rd, rs1, imm):  return i_type(imm, rs1, 4, rd, 0x13)
-def slli(rd, rs1, shamt): return i_type(shamt, rs1, 1, rd, 0x13)
-def srli(rd, rs1, shamt): return i_type(shamt, rs1, 5, rd, 0x13)
+# I-type and R-type wrappers are generated at import time with the
+# funct3/funct7/opcode constants folded into a single expression — no
+# call into the generic encoder per instruction, and no wrapper-per-
+# mnemonic boilerplate to extend as instructions are added.
+for _name, _f3, _op in [
+    ('addi', 0, 0x13), ('slti', 2, 0x13), ('xori', 4, 0x13),
+    ('ori',  6, 0x13), ('andi', 7, 0x13), ('slli', 1, 0x13),
+    ('srli', 5, 0x13), ('jalr', 0, 0x67),
+]:
+    exec(f"def {_name}(rd, rs1, imm): return ((imm & 0xFFF) << 20) | "
+         f"(rs1 << 15) | {(_f3 << 12)} | (rd << 7) | {_op}", globals())
+
+for _name, _f3 in [('lb', 0), ('lh', 1), ('lw', 2), ('lbu', 4), ('lhu', 5)]:
+    exec(f"def {_name}(rd, offset, rs1): return ((offset & 0xFFF) << 20) | "
+         f"(rs1 << 15) | {(_f3 << 12)} | (rd << 7) | 0x03", globals())
+
+for _name, _f3, _f7 in [('add', 0, 0x00), ('sub', 0, 0x20), ('slt', 2, 0x00)]:
+    exec(f"def {_name}(rd, rs1, rs2): return {(_f7 << 25)} | (rs2 << 20) | "
+         f"(rs1 << 15) | {(_f3 << 12)} | (rd << 7) | 0x33", globals())
+
 def srai(rd, rs1, shamt): return i_type(0x400 | shamt, rs1, 5, rd, 0x13)
-def slti(rd, rs1, imm):  return i_type(imm, rs1, 2, rd, 0x13)
-def slt(rd, rs1, rs2):   return r_type(0x00, rs2, rs1, 2, rd, 0x33)
 def lui(rd, imm):        return u_type(imm, rd, 0x37)
 def auipc(rd, imm):      return u_type(imm, rd, 0x17)
 def sw(rs2, offset, rs1): return s_type(offset, rs2, rs1, 2, 0x23)
 def sh(rs2, offset, rs1): return s_type(offset, rs2, rs1, 1, 0x23)
 def sb(rs2, offset, rs1): return s_type(offset, rs2, rs1, 0, 0x23)
-def lw(rd, offset, rs1):  return i_type(offset, rs1, 2, rd, 0x03)
-def lh(rd, offset, rs1):  return i_type(offset, rs1, 1, rd, 0x03)
-def lb(rd, offset, rs1):  return i_type(offset, rs1, 0, rd, 0x03)
-def lbu(rd, offset, rs1): return i_type(offset, rs1, 4, rd, 0x03)
-def lhu(rd, offset, rs1): return i_type(offset, rs1, 5, rd, 0x03)
 def beq(rs1, rs2, off):  return b_type(off, rs2, rs1, 0, 0x63)
 def bne(rs1, rs2, off):  return b_type(off, rs2, rs1, 1, 0x63)
 def blt(rs1, rs2, off):  return b_type(off, rs2, rs1, 4, 0x63)
@@ -67,6 +76,97 @@ def nop():               return addi(x0, x0, 0)
 def csrrw(rd, csr, rs1): return (csr << 20) | (rs1 << 15) | (1 << 12) | (rd << 7) | 0x73
 def csrrs(rd, csr, rs1): return (csr << 20) | (rs1 << 15) | (2 << 12) | (rd << 7) | 0x73
 
+# ── Vectorized batch encoding (optional, needs NumPy) ────────────────────
+# The scalar encoders above are plenty for this hand-written program, but
+# generated firmwares (random-instruction stress tests, long self-check
+# sequences) want to encode 100k+ instructions at once. Represent such a
+# program as a structured array and encode a whole opcode class per call.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INSTR_DTYPE = [('op', 'u1'), ('rd', 'u1'), ('rs1', 'u1'), ('rs2', 'u1'),
+               ('imm', 'i4')]
+
+# Mnemonic -> (shape, funct3, funct7, opcode). Shapes mirror the scalar
+# encoders; 'imm' holds the shift amount for shift-immediates and the
+# byte offset for loads/stores/branches/jumps.
+BATCH_OPS = {
+    'addi':  ('i', 0, 0,    0x13), 'andi': ('i', 7, 0,    0x13),
+    'ori':   ('i', 6, 0,    0x13), 'xori': ('i', 4, 0,    0x13),
+    'slti':  ('i', 2, 0,    0x13), 'slli': ('i', 1, 0,    0x13),
+    'srli':  ('i', 5, 0,    0x13), 'srai': ('i', 5, 0x400, 0x13),
+    'jalr':  ('i', 0, 0,    0x67),
+    'lw':    ('i', 2, 0,    0x03), 'lh':   ('i', 1, 0,    0x03),
+    'lb':    ('i', 0, 0,    0x03), 'lbu':  ('i', 4, 0,    0x03),
+    'lhu':   ('i', 5, 0,    0x03),
+    'add':   ('r', 0, 0x00, 0x33), 'sub':  ('r', 0, 0x20, 0x33),
+    'slt':   ('r', 2, 0x00, 0x33),
+    'sw':    ('s', 2, 0,    0x23), 'sh':   ('s', 1, 0,    0x23),
+    'sb':    ('s', 0, 0,    0x23),
+    'beq':   ('b', 0, 0,    0x63), 'bne':  ('b', 1, 0,    0x63),
+    'blt':   ('b', 4, 0,    0x63), 'bge':  ('b', 5, 0,    0x63),
+    'lui':   ('u', 0, 0,    0x37), 'auipc': ('u', 0, 0,   0x17),
+    'jal':   ('j', 0, 0,    0x6F),
+}
+OPCODES = {name: i for i, name in enumerate(BATCH_OPS)}
+
+
+def _enc_i(a, funct3, imm_or, opcode):
+    imm = (a['imm'].astype(np.uint32) | imm_or) & 0xFFF
+    return ((imm << 20) | (a['rs1'].astype(np.uint32) << 15) |
+            (funct3 << 12) | (a['rd'].astype(np.uint32) << 7) | opcode)
+
+def _enc_r(a, funct3, funct7, opcode):
+    return ((np.uint32(funct7) << 25) | (a['rs2'].astype(np.uint32) << 20) |
+            (a['rs1'].astype(np.uint32) << 15) | (funct3 << 12) |
+            (a['rd'].astype(np.uint32) << 7) | opcode)
+
+def _enc_s(a, funct3, _funct7, opcode):
+    imm = a['imm'].astype(np.uint32)
+    return ((((imm >> 5) & 0x7F) << 25) | (a['rs2'].astype(np.uint32) << 20) |
+            (a['rs1'].astype(np.uint32) << 15) | (funct3 << 12) |
+            ((imm & 0x1F) << 7) | opcode)
+
+def _enc_b(a, funct3, _funct7, opcode):
+    imm = a['imm'].astype(np.uint32)
+    return ((((imm >> 12) & 1) << 31) | (((imm >> 5) & 0x3F) << 25) |
+            (a['rs2'].astype(np.uint32) << 20) |
+            (a['rs1'].astype(np.uint32) << 15) | (funct3 << 12) |
+            (((imm >> 1) & 0xF) << 8) | (((imm >> 11) & 1) << 7) | opcode)
+
+def _enc_u(a, _funct3, _funct7, opcode):
+    return ((a['imm'].astype(np.uint32) & 0xFFFFF000) |
+            (a['rd'].astype(np.uint32) << 7) | opcode)
+
+def _enc_j(a, _funct3, _funct7, opcode):
+    imm = a['imm'].astype(np.uint32)
+    return ((((imm >> 20) & 1) << 31) | (((imm >> 1) & 0x3FF) << 21) |
+            (((imm >> 11) & 1) << 20) | (((imm >> 12) & 0xFF) << 12) |
+            (a['rd'].astype(np.uint32) << 7) | opcode)
+
+_SHAPE_ENCODERS = {'i': _enc_i, 'r': _enc_r, 's': _enc_s, 'b': _enc_b,
+                   'u': _enc_u, 'j': _enc_j}
+
+
+def encode_batch(arr):
+    """Encode a structured array (INSTR_DTYPE) into uint32 words.
+
+    One vectorized pass per opcode present in the array — no per-
+    instruction Python dispatch.
+    """
+    if np is None:
+        raise RuntimeError("encode_batch requires NumPy")
+    words = np.zeros(len(arr), dtype=np.uint32)
+    for name, (shape, funct3, funct7, opcode) in BATCH_OPS.items():
+        idx = np.nonzero(arr['op'] == OPCODES[name])[0]
+        if len(idx):
+            words[idx] = _SHAPE_ENCODERS[shape](arr[idx], funct3, funct7,
+                                                opcode)
+    return words
+
 program = [
     # ── ALU Tests ────────────────────────────────────────────────
     addi(x1, x0, 42),          # 0x00: x1 = 42
@@ -122,7 +222,10 @@ program = [
     sw(x22, 0, x20),            # 0x94: Transmit 'H'
 
     # ── Wait loop ────────────────────────────────────────────────
-    addi(x23, x0, 100),         # 0x98: counter = 100
+    # 8 iterations are enough to push the loop branch's 2-bit BHT
+    # counter out of its weakly-not-taken reset state; a longer count
+    # only burns simulation cycles.
+    addi(x23, x0, 8),           # 0x98: counter = 8
     addi(x23, x23, -1),         # 0x9C: counter--
     bne(x23, x0, -4),           # 0xA0: loop until zero → 0x9C (offset = -4)
 
@@ -139,14 +242,150 @@ program = [
 ]
 
 # Fix the JALR: make it jump forward to UART setup instead
-# Patch instruction at index 18 (0x74): jalr x20, x16, 0
+# Patch the jalr at 0x74 (index 29): jalr x20, x16, 0
 # x16 will hold 0x6C from the JAL. jalr x20, x16, 12 → 0x6C + 12 = 0x78
-program[18] = jalr(x20, x16, 12)  # Jump to 0x78
+# (An earlier version of this patch hit index 18 — the GPIO DIR store at
+# 0x48 — turning it into 'jalr x20, x16, 12' with x16 still zero, so the
+# program jumped back to 0x0C and spun in the ALU section forever.)
+program[29] = jalr(x20, x16, 12)  # Jump to 0x78
+
+
+# ── Peephole: fold repeated lui/addi address builds ──────────────────────
+
+def _simm12(instr):
+    imm = (instr >> 20) & 0xFFF
+    return imm - 0x1000 if imm & 0x800 else imm
+
+
+def _b_offset(instr):
+    off = (((instr >> 31) & 1) << 12) | (((instr >> 7) & 1) << 11) | \
+          (((instr >> 25) & 0x3F) << 5) | (((instr >> 8) & 0xF) << 1)
+    return off - 0x2000 if off & 0x1000 else off
+
+
+def _j_offset(instr):
+    off = (((instr >> 31) & 1) << 20) | (((instr >> 12) & 0xFF) << 12) | \
+          (((instr >> 20) & 1) << 11) | (((instr >> 21) & 0x3FF) << 1)
+    return off - 0x200000 if off & 0x100000 else off
+
+
+def peephole_fold_lui(prog):
+    """Fold 'lui rd, K; addi rd, rd, L2' into 'addi rd, rd, L2-L1'.
+
+    Fires when an earlier 'lui rd, K; addi rd, rd, L1' in the same
+    straight-line block means rd already holds K+L1 — the repeated
+    peripheral-base builds this firmware is full of. Branch and JAL
+    offsets spanning the removed slot are re-encoded; the pass bails out
+    if any decoded branch/JAL target lands between the two pairs.
+    Indirect (jalr) targets cannot be checked statically and are assumed
+    not to point between the pairs — true here, where the only jalr
+    lands on the first pair itself.
+    """
+    def is_lui(ins):    return ins & 0x7F == 0x37
+    def is_addi(ins):   return ins & 0x7F == 0x13 and ((ins >> 12) & 7) == 0
+    def rd_of(ins):     return (ins >> 7) & 0x1F
+    def rs1_of(ins):    return (ins >> 15) & 0x1F
+    def rs2_of(ins):    return (ins >> 20) & 0x1F
+    def funct3_of(ins): return (ins >> 12) & 7
+
+    def writes(ins):
+        # Stores and branches have no rd
+        return None if ins & 0x7F in (0x23, 0x63) else rd_of(ins)
+
+    def is_pair(p, k, rd, at):
+        return (is_lui(p[at]) and rd_of(p[at]) == rd and
+                (p[at] & 0xFFFFF000) == k and
+                at + 1 < len(p) and is_addi(p[at + 1]) and
+                rd_of(p[at + 1]) == rd and rs1_of(p[at + 1]) == rd)
+
+    prog = list(prog)
+    folded = True
+    while folded:
+        folded = False
+        # Control-flow edges as (source index, target index)
+        edges = []
+        for p, ins in enumerate(prog):
+            if ins & 0x7F == 0x63:
+                edges.append((p, p + _b_offset(ins) // 4))
+            elif ins & 0x7F == 0x6F:
+                edges.append((p, p + _j_offset(ins) // 4))
+
+        for i in range(len(prog) - 1):
+            if not (is_lui(prog[i]) and is_pair(prog, prog[i] & 0xFFFFF000,
+                                                rd_of(prog[i]), i)):
+                continue
+            rd = rd_of(prog[i])
+            k = prog[i] & 0xFFFFF000
+            l1 = _simm12(prog[i + 1])
+            # Walk the straight-line block for a matching second pair
+            j = i + 2
+            found = False
+            while j < len(prog) - 1:
+                if is_pair(prog, k, rd, j):
+                    found = True
+                    break
+                ins = prog[j]
+                # Stop at control flow, SYSTEM instructions, or a
+                # clobber of rd
+                if ins & 0x7F in (0x63, 0x67, 0x6F, 0x73) or writes(ins) == rd:
+                    break
+                j += 1
+            if not found:
+                continue
+            l2 = _simm12(prog[j + 1])
+            if not -2048 <= l2 - l1 <= 2047:
+                continue
+            if any(i + 1 < t <= j + 1 for _, t in edges):
+                continue
+
+            # Drop the second lui and rebase its addi on the live rd
+            del prog[j]
+            prog[j] = addi(rd, rd, l2 - l1)
+
+            # Re-encode branch/JAL offsets that span the removed slot
+            for p, t in edges:
+                if p == j or (p < j) == (t <= j):
+                    continue
+                np_ = p - 1 if p > j else p
+                nt = t - 1 if t > j else t
+                ins = prog[np_]
+                if ins & 0x7F == 0x63:
+                    prog[np_] = b_type((nt - np_) * 4, rs2_of(ins),
+                                       rs1_of(ins), funct3_of(ins))
+                else:
+                    prog[np_] = j_type((nt - np_) * 4, rd_of(ins))
+            folded = True
+            break
+    return prog
+
+
+# Note: the byte-offset comments in the program listing above are
+# pre-fold addresses; everything past the fold point moves down.
+program = peephole_fold_lui(program)
+
+HEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "firmware.hex")
+
+
+def write_hex(program, path=HEX_PATH):
+    """Write the program as a $readmemh file.
+
+    Hex-encodes the whole program in two C-level passes instead of one
+    format call per instruction: pack the words big-endian so hexlify
+    emits MSB-first digits in $readmemh word order, then split the
+    digit stream into 8-character lines.
+    """
+    arr = array.array('I', (instr & 0xFFFFFFFF for instr in program))
+    if sys.byteorder == 'little':
+        arr.byteswap()
+    digits = binascii.hexlify(arr.tobytes()).upper()
+    lines = b"\n".join(digits[i:i + 8] for i in range(0, len(digits), 8))
+    with open(path, "wb") as f:
+        f.write(lines + b"\n")
 
-with open("/home/claude/riscv_mcu/firmware/firmware.hex", "w") as f:
-    for instr in program:
-        f.write(f"{instr & 0xFFFFFFFF:08X}\n")
 
-print(f"Generated {len(program)} instructions")
-for i, instr in enumerate(program):
-    print(f"  0x{i*4:04X}: {instr & 0xFFFFFFFF:08X}")
+if __name__ == "__main__":
+    write_hex(program)
+    print(f"Generated {len(program)} instructions")
+    for i, instr in enumerate(program):
+        print(f"  0x{i*4:04X}: {instr & 0xFFFFFFFF:08X}")
@@ -39,6 +39,13 @@ module csr (
   assign mtvec_out = mtvec;
   assign mepc_out  = mepc;
 
+  // 32-bit aliases of the counter low words for testbench observation.
+  // Reading these over VPI moves half the bytes of the full 64-bit
+  // counters and needs no masking on the Python side.
+  logic [31:0] mcycle_lo, minstret_lo;
+  assign mcycle_lo   = mcycle[31:0];
+  assign minstret_lo = minstret[31:0];
+
   // Interrupt pending
   always_comb begin
     mip = 32'b0;